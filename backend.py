@@ -3,19 +3,24 @@ FastAPI Backend for Ask The Storytell AI
 Handles API requests for chat, image generation, audio generation, and audio transcription
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Optional, List, Dict
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, List, Dict, Sequence, Tuple
+import asyncio
 import logging
+import os
+import re
+import secrets
+import orjson
 import uvicorn
 import config
 from document_processor import get_processor
 from storyteller import Storyteller
-import tempfile
-import os
+from semantic_cache import SemanticCache
+from session_store import create_session_store
 
 # Set up logging
 logging.basicConfig(
@@ -32,7 +37,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Ask The Storytell AI",
     description="Witty storytelling chatbot with multimodal responses",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -40,40 +46,156 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=config.CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
+class MediaStaticFiles(StaticFiles):
+    """Static files that let browsers cache content-hashed generated media indefinitely"""
+    
+    HASHED_NAME = re.compile(r"[0-9a-f]{32}\.(?:png|mp3)")
+    
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if self.HASHED_NAME.fullmatch(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 # Mount static directories
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", MediaStaticFiles(directory="static"), name="static")
+
+# Knowledge base status, computed once at startup and read by every request
+app.state.initialized = False
+app.state.chunk_count = 0
 
 # Initialize components on startup
 processor = None
 storyteller = None
-conversation_sessions: Dict[str, List[Dict]] = {}  # Session-based conversation memory
+semantic_cache = None
+warmup_task = None
+fallback_warmup_task = None
+inflight: Dict[Tuple, asyncio.Future] = {}  # Generations in progress, shared by identical requests
+session_store = create_session_store()  # Session-based conversation memory
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize document processor and storyteller on startup"""
-    global processor, storyteller
+    global processor, storyteller, semantic_cache, warmup_task, fallback_warmup_task
     
     logger.info("🚀 Starting Ask The Storytell AI...")
     
     # Initialize document processor
     processor = get_processor()
     
-    if not processor.is_initialized():
+    app.state.initialized = processor.is_initialized()
+    app.state.chunk_count = len(processor.chunks)
+    
+    if not app.state.initialized:
         logger.error("❌ No PDFs found or processed. Please add PDF files to data/pdfs/")
     else:
-        logger.info(f"✅ Knowledge base loaded with {len(processor.chunks)} chunks")
+        logger.info(f"✅ Knowledge base loaded with {app.state.chunk_count} chunks")
+    
+    if config.SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticCache(
+            path=config.SEMANTIC_CACHE_PATH if config.SEMANTIC_CACHE_PERSIST else None
+        )
+        logger.info("✅ Semantic response cache enabled")
     
     # Initialize storyteller
-    storyteller = Storyteller(processor)
+    storyteller = Storyteller(processor, semantic_cache)
     logger.info("✅ Storyteller initialized")
     
+    # Pre-answer suggested questions in the background so the first click on each is a cache hit
+    if semantic_cache is not None and config.CACHE_WARMUP_ENABLED and app.state.initialized and storyteller.has_llm():
+        warmup_task = asyncio.create_task(warm_semantic_cache())
+    
+    # Off-topic replies are fixed per language, so illustrate and narrate each one just once
+    if config.FALLBACK_MEDIA_WARMUP_ENABLED:
+        fallback_warmup_task = asyncio.create_task(storyteller.warm_fallback_media())
+    
     logger.info(f"🎯 Server ready at http://{config.API_HOST}:{config.API_PORT}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on shutdown"""
+    for task in (warmup_task, fallback_warmup_task):
+        if task is not None:
+            task.cancel()
+    if storyteller is not None:
+        await storyteller.aclose()
+    await session_store.aclose()
+    if semantic_cache is not None:
+        semantic_cache.close()
+
+
+async def get_response(
+    question: str,
+    generate_image: bool,
+    generate_audio: bool,
+    language: str,
+    conversation_history: Sequence[Dict]
+) -> Dict:
+    """Answer a question via the storyteller (and its semantic cache)"""
+    kwargs = dict(
+        question=question,
+        generate_image=generate_image,
+        generate_audio=generate_audio,
+        language=language,
+        conversation_history=conversation_history
+    )
+    
+    # Answers shaped by one session's conversation must never reach another session
+    if conversation_history:
+        return await storyteller.generate_response(**kwargs)
+    
+    # Collapse concurrent identical questions into a single generation
+    flight_key = (question, language, generate_image, generate_audio)
+    future = inflight.get(flight_key)
+    if future is not None:
+        logger.info("🔗 Joining in-flight generation for identical question")
+        return dict(await asyncio.shield(future))
+    
+    future = asyncio.get_running_loop().create_future()
+    inflight[flight_key] = future
+    try:
+        result = await storyteller.generate_response(**kwargs)
+        future.set_result(dict(result))  # Callers mutate their copy (URLs, history)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved so a follower-less failure isn't logged twice
+        raise
+    finally:
+        inflight.pop(flight_key, None)
+    return result
+
+
+async def warm_semantic_cache():
+    """Answer every suggested question (per warm-up language) so the cache already holds them"""
+    semaphore = asyncio.Semaphore(config.CACHE_WARMUP_CONCURRENCY)
+    
+    async def warm(question: str, language: str):
+        async with semaphore:
+            try:
+                # Same flags the frontend sends, so the entries land in the mode it looks up
+                await get_response(question, True, True, language, [])
+            except Exception as e:
+                logger.warning("⚠️ Cache warm-up failed for %r: %s", question, e)
+    
+    await asyncio.gather(*(
+        warm(question, language)
+        for language in config.CACHE_WARMUP_LANGUAGES
+        for question in config.SUGGESTED_QUESTIONS
+    ))
+    await asyncio.to_thread(semantic_cache.flush)
+    logger.info(f"🔥 Semantic cache warmed with {len(config.SUGGESTED_QUESTIONS)} suggested questions")
+
+
 # Request/Response models
 class ChatRequest(BaseModel):
     question: str
@@ -84,22 +206,24 @@ class ChatRequest(BaseModel):
 
 
 class ChatResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     answer: str
     image_url: Optional[str] = None
     audio_url: Optional[str] = None
     is_relevant: bool
-    sources: list = []
-    conversation_history: list = []
+    sources: List[Dict[str, str]] = []
+    conversation_history: List[Dict[str, str]] = []
 
 
 # API Routes
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Health check endpoint"""
     return {
         "status": "running",
         "name": config.STORYTELLER_NAME,
-        "chunks_loaded": len(processor.chunks) if processor else 0
+        "chunks_loaded": request.app.state.chunk_count
     }
 
 
@@ -118,82 +242,58 @@ async def get_languages():
 @app.post("/api/transcribe")
 async def transcribe_audio(audio: UploadFile = File(...)):
     """Transcribe audio to text using Whisper"""
-    temp_path = None
     try:
-        logger.info(f"🎤 Received audio file: {audio.filename}, type: {audio.content_type}")
-        
-        # Save uploaded file temporarily with original extension
-        file_ext = os.path.splitext(audio.filename)[1] if audio.filename else ".webm"
-        if not file_ext:
-            file_ext = ".webm"
-            
-        # Create temp file but keep it open so Windows doesn't delete it
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-        try:
-            content = await audio.read()
-            temp_file.write(content)
-            temp_file.flush()  # Ensure data is written to disk
-            temp_path = temp_file.name
-        finally:
-            temp_file.close()  # Close but don't delete yet
+        logger.info("🎤 Received audio file: %s, type: %s", audio.filename, audio.content_type)
         
-        logger.info(f"📁 Saved to: {temp_path}, size: {os.path.getsize(temp_path)} bytes")
+        # Stream the upload in chunks into a single buffer handed straight to Whisper
+        content = bytearray()
+        while chunk := await audio.read(config.UPLOAD_CHUNK_SIZE):
+            content.extend(chunk)
+            if len(content) > config.MAX_AUDIO_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Audio file too large")
         
-        # Verify file exists and is readable
-        if not os.path.exists(temp_path):
-            raise Exception(f"Temp file not found: {temp_path}")
+        text = await storyteller.transcribe_bytes(content, audio.content_type)
         
-        # Transcribe
-        text = await storyteller.transcribe_audio(temp_path)
-        
-        logger.info(f"✅ Transcription successful: {text[:50]}...")
+        logger.info("✅ Transcription successful: %s...", text[:50])
         return {"text": text}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Error transcribing audio: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("❌ Error transcribing audio: %s", e)
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
-    finally:
-        # Clean up temp file
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-                logger.info(f"🗑️ Cleaned up temp file: {temp_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ Could not delete temp file {temp_path}: {e}")
 
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, http_request: Request):
+async def chat(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks):
     """
     Main chat endpoint - processes question and returns multimodal response
     Supports conversation history and multi-language
     """
     try:
-        if not processor or not processor.is_initialized():
+        if not http_request.app.state.initialized:
             raise HTTPException(
                 status_code=503,
                 detail="Knowledge base not initialized. Please add PDF files."
             )
         
-        logger.info(f"📝 Question received: {request.question[:100]}...")
+        logger.info("📝 Question received: %s...", request.question[:100])
         
         # Get or create conversation history
         session_id = request.session_id
-        if session_id not in conversation_sessions:
-            conversation_sessions[session_id] = []
-        
-        conversation_history = conversation_sessions[session_id]
+        conversation_history = await session_store.get(session_id)
         
         # Generate response
-        result = await storyteller.generate_response(
+        result = await get_response(
             question=request.question,
             generate_image=request.generate_image,
             generate_audio=request.generate_audio,
             language=request.language,
             conversation_history=conversation_history
         )
+        if semantic_cache is not None:
+            # Persist new cache entries after the response is sent instead of on the request path
+            background_tasks.add_task(semantic_cache.flush)
         
         # Update conversation history
         conversation_history.append({
@@ -205,41 +305,115 @@ async def chat(request: ChatRequest, http_request: Request):
             "content": result["answer"]
         })
         
-        # Trim history to max length
-        if len(conversation_history) > config.MAX_CONVERSATION_HISTORY * 2:
-            conversation_history = conversation_history[-config.MAX_CONVERSATION_HISTORY * 2:]
-        
-        conversation_sessions[session_id] = conversation_history
+        # History is a bounded deque, so the oldest messages drop off on their own
+        await session_store.set(session_id, conversation_history)
         
         # Normalize media URLs to absolute using request base URL to avoid broken links across origins/proxies
-        try:
+        # (text-only requests have no media to rewrite)
+        if request.generate_image or request.generate_audio:
             base_url = str(http_request.base_url).rstrip('/')
-            for key in ("image_url", "audio_url"):
-                url_val = result.get(key)
-                if isinstance(url_val, str) and url_val.startswith("/"):
-                    result[key] = f"{base_url}{url_val}"
-        except Exception as _e:
-            # Non-fatal; keep relative URLs if any issue occurs
-            pass
+            if (url_val := result.get("image_url")) and url_val.startswith("/"):
+                result["image_url"] = base_url + url_val
+            if (url_val := result.get("audio_url")) and url_val.startswith("/"):
+                result["audio_url"] = base_url + url_val
 
         # Add history to response
-        result["conversation_history"] = conversation_history
+        result["conversation_history"] = list(conversation_history)
         
-        return ChatResponse(**result)
+        # The dict is built by our own code and already matches ChatResponse (which still
+        # documents the endpoint), so skip re-validating it and serialize it directly
+        return ORJSONResponse(content=result)
         
     except Exception as e:
-        logger.error(f"❌ Error processing chat request: {str(e)}")
+        logger.error("❌ Error processing chat request: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks):
+    """
+    Streaming chat endpoint - Server-Sent Events with the answer text as it is generated,
+    then the image and audio URLs as each finishes, then the full response ("done")
+    """
+    if not http_request.app.state.initialized:
+        raise HTTPException(
+            status_code=503,
+            detail="Knowledge base not initialized. Please add PDF files."
+        )
+    
+    logger.info("📝 Streaming question received: %s...", request.question[:100])
+    
+    session_id = request.session_id
+    conversation_history = await session_store.get(session_id)
+    base_url = str(http_request.base_url).rstrip('/')
+    
+    def absolute(url: Optional[str]) -> Optional[str]:
+        return base_url + url if url and url.startswith("/") else url
+    
+    def sse(event: str, data: Dict) -> str:
+        return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+    
+    async def events():
+        try:
+            async for event, data in storyteller.generate_response_stream(
+                question=request.question,
+                generate_image=request.generate_image,
+                generate_audio=request.generate_audio,
+                language=request.language,
+                conversation_history=conversation_history
+            ):
+                if event == "done":
+                    result = data
+                    break
+                if event in ("image", "audio"):
+                    data = {"url": absolute(data["url"])}
+                yield sse(event, data)
+            
+            conversation_history.append({"role": "user", "content": request.question})
+            conversation_history.append({"role": "assistant", "content": result["answer"]})
+            await session_store.set(session_id, conversation_history)
+            
+            yield sse("done", {
+                **result,
+                "image_url": absolute(result.get("image_url")),
+                "audio_url": absolute(result.get("audio_url")),
+                "conversation_history": list(conversation_history)
+            })
+        except Exception as e:
+            logger.error("❌ Error streaming chat response: %s", e)
+            yield sse("error", {"detail": str(e)})
+    
+    if semantic_cache is not None:
+        background_tasks.add_task(semantic_cache.flush)
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/api/cache/clear")
+async def clear_cache(request: Request):
+    """Drop cached responses and memoized question embeddings (requires CACHE_ADMIN_TOKEN)"""
+    if not config.CACHE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {config.CACHE_ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    
+    if semantic_cache is not None:
+        semantic_cache.clear()
+        # The SQLite delete waits on the file lock - keep it off the event loop
+        await asyncio.to_thread(semantic_cache.flush)
+    if processor:
+        processor.clear_embedding_cache()
+    return {"status": "cleared"}
+
+
 @app.get("/api/health")
-async def health_check():
+async def health_check(request: Request):
     """Detailed health check"""
     return {
         "status": "healthy",
         "knowledge_base": {
-            "initialized": processor.is_initialized() if processor else False,
-            "chunks": len(processor.chunks) if processor else 0
+            "initialized": request.app.state.initialized,
+            "chunks": request.app.state.chunk_count
         },
         "apis": {
             "gemini": bool(config.GEMINI_API_KEY),
@@ -251,11 +425,14 @@ async def health_check():
 
 def main():
     """Run the FastAPI server"""
+    logger.info(f"⚙️ Launching {config.API_WORKERS} worker(s)")
+    
     uvicorn.run(
         "backend:app",
         host=config.API_HOST,
         port=config.API_PORT,
-        reload=config.API_RELOAD,
+        workers=config.API_WORKERS,
+        reload=config.API_RELOAD and config.API_WORKERS == 1,  # reload forces a single worker
         log_level=config.LOG_LEVEL.lower()
     )
 
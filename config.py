@@ -14,6 +14,7 @@ load_dotenv()
 BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 PDF_DIR = DATA_DIR / "pdfs"
+CACHE_DIR = DATA_DIR / "cache"
 STATIC_DIR = BASE_DIR / "static"
 IMAGES_DIR = STATIC_DIR / "images"
 AUDIO_DIR = STATIC_DIR / "audio"
@@ -21,6 +22,7 @@ AUDIO_DIR = STATIC_DIR / "audio"
 # Create directories if they don't exist
 DATA_DIR.mkdir(exist_ok=True)
 PDF_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(exist_ok=True)
 STATIC_DIR.mkdir(exist_ok=True)
 IMAGES_DIR.mkdir(exist_ok=True)
 AUDIO_DIR.mkdir(exist_ok=True)
@@ -40,6 +42,8 @@ LLM_MAX_TOKENS = 800  # Longer, better answers
 # Embedding Model Configuration
 EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 # CPU-friendly, fast, accurate
+EMBEDDING_BATCH_SIZE = 64  # Chunks per forward pass when ingesting PDFs
+EMBEDDING_CACHE_SIZE = 2048  # Memoized question embeddings (exact text match)
 
 # Retrieval Configuration
 CHUNK_SIZE = 1000  # Optimized for faster processing
@@ -61,6 +65,23 @@ ELEVENLABS_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"  # Rachel - warm storyteller voice
 AUDIO_STABILITY = 0.5
 AUDIO_SIMILARITY_BOOST = 0.75
 
+# Speech-to-Text Configuration
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "faster-whisper")  # Options: "faster-whisper" or "whispercpp"
+# faster-whisper (CTranslate2)
+WHISPER_MODEL = "base"
+WHISPER_COMPUTE_TYPE = "int8"  # int8 quantized weights: ~4x faster and smaller than float32 on CPU
+# whisper.cpp via pywhispercpp (AVX2 kernels, 5-bit quantized ggml weights)
+WHISPERCPP_MODEL = "base.en-q5_1"
+
+# Outgoing HTTP (image/audio APIs)
+HTTP_POOL_SIZE = 32  # Max pooled keep-alive connections shared by media generation
+MEDIA_CHUNK_SIZE = 64 * 1024  # Bytes per chunk when streaming generated media to disk
+
+# Max in-flight calls per upstream service (per worker process)
+IMG_CONCURRENCY = 8
+AUDIO_CONCURRENCY = 8
+LLM_CONCURRENCY = 8
+
 # Storyteller Persona Configuration
 STORYTELLER_NAME = "Ask The Storytell AI"
 STORYTELLER_PROMPT = """You are "Ask The Storytell AI" — a hilariously witty, sarcastically brilliant storyteller who treats classic literature like juicy gossip. Think of yourself as a stand-up comedian who moonlights as a librarian! 😏
@@ -101,7 +122,11 @@ Bring me questions about the classics I actually know, and I'll serve you the li
 API_HOST = "0.0.0.0"
 API_PORT = 9000
 API_RELOAD = False  # Production mode for stability
+# Uvicorn worker processes - set to your core count in production (and REDIS_URL when > 1)
+API_WORKERS = int(os.getenv("API_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
 CORS_ORIGINS = ["*"]
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk when receiving uploads
+MAX_AUDIO_UPLOAD_BYTES = 25 * 1024 * 1024  # Reject voice uploads larger than this
 
 # Multi-language Support
 SUPPORTED_LANGUAGES = {
@@ -119,6 +144,22 @@ SUPPORTED_LANGUAGES = {
 
 # Conversation Memory
 MAX_CONVERSATION_HISTORY = 10  # Max messages to keep in memory
+MAX_SESSIONS = 10000  # Sessions kept in memory before the oldest are evicted
+SESSION_TTL_SECONDS = 3600  # Idle sessions expire after this long
+REDIS_URL = os.getenv("REDIS_URL", "")  # Set to share sessions across workers
+
+# Semantic Response Cache (near-duplicate questions reuse a previous answer)
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_MAX_SIZE = 10000  # Cached responses before LRU eviction
+SEMANTIC_CACHE_THRESHOLD = 0.95  # Min cosine similarity between questions for a hit
+SEMANTIC_CACHE_TTL_SECONDS = 24 * 3600  # Cached responses older than this are regenerated
+SEMANTIC_CACHE_PERSIST = True  # Keep cached responses across restarts
+SEMANTIC_CACHE_PATH = CACHE_DIR / "semantic_cache.sqlite3"
+CACHE_WARMUP_ENABLED = True  # Pre-answer SUGGESTED_QUESTIONS at startup
+CACHE_WARMUP_LANGUAGES = ["en"]  # Each extra language costs one full generation per question
+CACHE_WARMUP_CONCURRENCY = 2  # Parallel warm-up generations (keeps provider load low)
+FALLBACK_MEDIA_WARMUP_ENABLED = True  # Pre-generate the off-topic reply's image/audio per language at startup
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN", "")  # Bearer token for POST /api/cache/clear (disabled if empty)
 
 # Logging Configuration
 LOG_LEVEL = "INFO"
@@ -7,6 +7,7 @@ Lightweight in-memory approach with disk caching for fast startup
 import logging
 import pickle
 import hashlib
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Tuple
 import PyPDF2
@@ -29,14 +30,16 @@ class DocumentProcessor:
         # Initialize embeddings model
         self.embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
         
+        # Memoized query encoder - repeated questions skip the model entirely
+        self._embed_cached = lru_cache(maxsize=config.EMBEDDING_CACHE_SIZE)(self._encode_query)
+        
         # In-memory storage
         self.chunks = []  # List of text chunks
-        self.embeddings = None  # Numpy array of embeddings
+        self.embeddings = None  # Numpy array of unit-norm embeddings
         self.metadata = []  # List of metadata dicts
         
         # Cache directory
-        self.cache_dir = config.DATA_DIR / "cache"
-        self.cache_dir.mkdir(exist_ok=True)
+        self.cache_dir = config.CACHE_DIR
         
         logger.info("Document processor initialized with caching enabled")
     
@@ -180,9 +183,9 @@ class DocumentProcessor:
         
         logger.info(f"Found {len(pdf_files)} PDF files to process")
         
-        all_chunks = []
-        all_metadata = []
-        all_embeddings_list = []
+        # Per-PDF (chunks, metadata, embeddings) in directory order; embeddings filled in below if not cached
+        books = []
+        pending = []  # Indices into books that still need embeddings
         
         for pdf_file in pdf_files:
             try:
@@ -191,9 +194,7 @@ class DocumentProcessor:
                 
                 if cached_chunks is not None:
                     # Use cached data
-                    all_chunks.extend(cached_chunks)
-                    all_metadata.extend(cached_metadata)
-                    all_embeddings_list.append(cached_embeddings)
+                    books.append((pdf_file, cached_chunks, cached_metadata, cached_embeddings))
                 else:
                     # Process PDF from scratch
                     logger.info(f"📄 Processing {pdf_file.name}...")
@@ -203,30 +204,12 @@ class DocumentProcessor:
                         # Chunk text
                         chunks_with_meta = self.chunk_text(text, pdf_file.name)
                         
-                        pdf_chunks = []
-                        pdf_metadata = []
-                        
-                        for chunk, meta in chunks_with_meta:
-                            pdf_chunks.append(chunk)
-                            pdf_metadata.append(meta)
+                        pdf_chunks = [chunk for chunk, _ in chunks_with_meta]
+                        pdf_metadata = [meta for _, meta in chunks_with_meta]
                         
                         if pdf_chunks:
-                            # Generate embeddings for this PDF
-                            logger.info(f"🔄 Generating embeddings for {len(pdf_chunks)} chunks from {pdf_file.name}...")
-                            pdf_embeddings = self.embedding_model.encode(
-                                pdf_chunks,
-                                show_progress_bar=True,
-                                convert_to_numpy=True
-                            )
-                            
-                            # Save to cache
-                            self._save_to_cache(str(pdf_file), pdf_chunks, pdf_metadata, pdf_embeddings)
-                            
-                            # Add to collection
-                            all_chunks.extend(pdf_chunks)
-                            all_metadata.extend(pdf_metadata)
-                            all_embeddings_list.append(pdf_embeddings)
-                            
+                            pending.append(len(books))
+                            books.append((pdf_file, pdf_chunks, pdf_metadata, None))
                             logger.info(f"✅ Created {len(pdf_chunks)} chunks from {pdf_file.name}")
                     
             except Exception as e:
@@ -235,6 +218,38 @@ class DocumentProcessor:
                 logger.error(traceback.format_exc())
                 continue
         
+        if pending:
+            # Embed every new chunk in one batched call, then split back per PDF
+            new_chunks = [chunk for i in pending for chunk in books[i][1]]
+            logger.info(f"🔄 Generating embeddings for {len(new_chunks)} chunks from {len(pending)} new books...")
+            try:
+                new_embeddings = self.embedding_model.encode(
+                    new_chunks,
+                    batch_size=config.EMBEDDING_BATCH_SIZE,
+                    show_progress_bar=True,
+                    convert_to_numpy=True
+                )
+                
+                offset = 0
+                for i in pending:
+                    pdf_file, pdf_chunks, pdf_metadata, _ = books[i]
+                    pdf_embeddings = new_embeddings[offset:offset + len(pdf_chunks)]
+                    offset += len(pdf_chunks)
+                    
+                    # Save to cache
+                    self._save_to_cache(str(pdf_file), pdf_chunks, pdf_metadata, pdf_embeddings)
+                    books[i] = (pdf_file, pdf_chunks, pdf_metadata, pdf_embeddings)
+            except Exception as e:
+                logger.error(f"Error generating embeddings: {str(e)}")
+                import traceback
+                logger.error(traceback.format_exc())
+                # Keep whatever was loaded from cache
+                books = [book for book in books if book[3] is not None]
+        
+        all_chunks = [chunk for _, chunks, _, _ in books for chunk in chunks]
+        all_metadata = [meta for _, _, metadata, _ in books for meta in metadata]
+        all_embeddings_list = [embeddings for _, _, _, embeddings in books]
+        
         if not all_chunks:
             logger.warning("No chunks created from PDFs")
             return 0
@@ -242,7 +257,12 @@ class DocumentProcessor:
         # Combine all embeddings
         self.chunks = all_chunks
         self.metadata = all_metadata
-        self.embeddings = np.vstack(all_embeddings_list) if all_embeddings_list else np.array([])
+        embeddings = np.vstack(all_embeddings_list).astype(np.float32, copy=False)
+        
+        # Normalize rows once so each search is a single matrix-vector product
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.embeddings = embeddings / norms
         
         logger.info(f"✨ Knowledge base ready with {len(self.chunks)} chunks from {len(pdf_files)} books")
         return len(self.chunks)
@@ -266,15 +286,15 @@ class DocumentProcessor:
             return []
         
         # Encode query
-        query_embedding = self.embedding_model.encode([query], convert_to_numpy=True)[0]
+        query_embedding = self.embed_query(query)
         
-        # Compute cosine similarities
-        similarities = np.dot(self.embeddings, query_embedding) / (
-            np.linalg.norm(self.embeddings, axis=1) * np.linalg.norm(query_embedding)
-        )
+        # Compute cosine similarities (both sides are unit-norm)
+        similarities = self.embeddings @ query_embedding
         
-        # Get top k indices
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        # Get top k indices: partial selection, then sort only those k
+        top_k = min(top_k, len(similarities))
+        top_indices = np.argpartition(similarities, -top_k)[-top_k:]
+        top_indices = top_indices[np.argsort(similarities[top_indices])[::-1]]
         
         # Return results
         results = []
@@ -288,6 +308,30 @@ class DocumentProcessor:
         logger.info(f"Found {len(results)} relevant chunks for query: {query[:50]}...")
         return results
     
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Encode a single query into a unit-length embedding (memoized per exact text)
+        
+        Args:
+            text: Query text
+            
+        Returns:
+            Normalized float32 embedding vector (read-only, shared between callers)
+        """
+        return self._embed_cached(text)
+    
+    def _encode_query(self, text: str) -> np.ndarray:
+        """Run the embedding model on a single query"""
+        embedding = self.embedding_model.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0]
+        embedding = embedding.astype(np.float32, copy=False)
+        embedding.flags.writeable = False  # Cached arrays must never be mutated in place
+        return embedding
+    
+    def clear_embedding_cache(self):
+        """Drop all memoized query embeddings"""
+        self._embed_cached.cache_clear()
+        logger.info("🧹 Query embedding cache cleared")
+    
     def is_initialized(self) -> bool:
         """Check if knowledge base is loaded"""
         return self.embeddings is not None and len(self.chunks) > 0
@@ -0,0 +1,227 @@
+"""
+Semantic Cache Module
+Caches chat responses keyed by question embedding so that repeated or
+paraphrased questions skip retrieval, LLM, image and audio generation.
+Optionally persisted to SQLite so the cache survives restarts.
+"""
+
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Hashable, Optional
+import numpy as np
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """Bounded LRU + TTL cache of responses looked up by cosine similarity of question embeddings"""
+
+    def __init__(
+        self,
+        max_size: int = None,
+        threshold: float = None,
+        ttl_seconds: float = None,
+        path: Path = None
+    ):
+        """
+        Initialize semantic cache
+
+        Args:
+            max_size: Maximum number of cached responses (LRU evicted beyond this)
+            threshold: Minimum cosine similarity for a cached question to count as a hit
+            ttl_seconds: Seconds after which a cached response is no longer served
+            path: SQLite file to persist entries to and reload them from (in-memory only if None)
+        """
+        self.max_size = max_size or config.SEMANTIC_CACHE_MAX_SIZE
+        self.threshold = config.SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl_seconds = ttl_seconds or config.SEMANTIC_CACHE_TTL_SECONDS
+
+        # Slot-based storage: row i of the matrix, mode and payload all belong to slot i
+        self._vectors = None  # (max_size, dim) unit-norm embeddings, allocated on first put
+        self._modes = np.full(self.max_size, -1, dtype=np.int32)  # -1 marks an empty slot
+        self._expires = np.zeros(self.max_size, dtype=np.float64)  # Unix time each slot goes stale
+        self._payloads: list = [None] * self.max_size
+        self._keys: list = [None] * self.max_size
+        self._slot_by_key: Dict[str, int] = {}
+        self._mode_ids: Dict[Hashable, int] = {}
+        self._free = list(range(self.max_size - 1, -1, -1))  # pop() hands out the lowest slot first
+        self._lru = OrderedDict()  # slot -> None, least recently used first
+        self._high_water = 0  # slots at or above this index have never been used
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._pending: list = []  # (sql, params) writes queued for flush()
+        self._pending_lock = threading.Lock()  # put() appends on the event loop while flush() swaps on a worker thread
+        if path is not None:
+            self._open(path)
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def get(self, embedding: np.ndarray, mode: Hashable) -> Optional[Dict]:
+        """
+        Look up a cached response for a question
+
+        Args:
+            embedding: Unit-norm question embedding
+            mode: Hashable key of generation options (language, media flags);
+                entries are only matched within the same mode
+
+        Returns:
+            Copy of the cached response dict, or None on miss
+        """
+        mode_id = self._mode_ids.get(mode)
+        if mode_id is None or not self._lru:
+            return None
+
+        n = self._high_water
+        scores = self._vectors[:n] @ embedding
+        scores[(self._modes[:n] != mode_id) | (self._expires[:n] <= time.time())] = -np.inf
+        slot = int(np.argmax(scores))
+
+        if scores[slot] < self.threshold:
+            return None
+
+        self._lru.move_to_end(slot)
+        return dict(self._payloads[slot])
+
+    def put(self, embedding: np.ndarray, mode: Hashable, payload: Dict):
+        """
+        Store a response for a question, evicting the least recently used entry if full.
+        When persisted, the write is queued until flush() so callers can defer disk I/O.
+
+        Args:
+            embedding: Unit-norm question embedding
+            mode: Hashable key of generation options (see get)
+            payload: Response dict to cache (a shallow copy is stored)
+        """
+        key = hashlib.sha256(repr(mode).encode() + embedding.tobytes()).hexdigest()
+        created = time.time()
+        evicted = self._insert(key, mode, embedding, payload, created)
+
+        if self._db is not None:
+            writes = []
+            if evicted is not None:
+                writes.append(("DELETE FROM responses WHERE key = ?", (evicted,)))
+            writes.append((
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(mode), embedding.tobytes(), json.dumps(payload), created)
+            ))
+            # Queue the eviction and insert together so one flush always writes both
+            with self._pending_lock:
+                self._pending.extend(writes)
+
+    def flush(self):
+        """Write queued inserts/evictions to the SQLite file (safe to call from a worker thread)"""
+        with self._db_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if self._db is None or not pending:
+                return
+            try:
+                with self._db:
+                    for sql, params in pending:
+                        self._db.execute(sql, params)
+            except Exception as e:
+                logger.warning(f"Semantic cache save failed: {e}")
+
+    def clear(self):
+        """Drop all cached responses (the on-disk delete is queued for flush())"""
+        self._vectors = None
+        self._modes.fill(-1)
+        self._payloads = [None] * self.max_size
+        self._keys = [None] * self.max_size
+        self._slot_by_key.clear()
+        self._free = list(range(self.max_size - 1, -1, -1))
+        self._lru.clear()
+        self._high_water = 0
+
+        if self._db is not None:
+            # Supersedes anything queued so far; puts made after this land after the delete
+            with self._pending_lock:
+                self._pending = [("DELETE FROM responses", ())]
+        logger.info("🧹 Semantic cache cleared")
+
+    def close(self):
+        """Close the backing SQLite file, if any"""
+        self.flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _insert(
+        self,
+        key: str,
+        mode: Hashable,
+        embedding: np.ndarray,
+        payload: Dict,
+        created: float
+    ) -> Optional[str]:
+        """Place an entry in a slot; returns the key of the entry evicted to make room, if any"""
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_size, embedding.shape[0]), dtype=np.float32)
+
+        evicted = None
+        slot = self._slot_by_key.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot, _ = self._lru.popitem(last=False)
+                evicted = self._keys[slot]
+                del self._slot_by_key[evicted]
+
+        mode_id = self._mode_ids.setdefault(mode, len(self._mode_ids))
+        self._vectors[slot] = embedding
+        self._modes[slot] = mode_id
+        self._expires[slot] = created + self.ttl_seconds
+        self._payloads[slot] = dict(payload)
+        self._keys[slot] = key
+        self._slot_by_key[key] = slot
+        self._lru[slot] = None
+        self._lru.move_to_end(slot)
+        self._high_water = max(self._high_water, slot + 1)
+        return evicted
+
+    def _open(self, path: Path):
+        """Open the SQLite store and load the most recent entries into memory"""
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, mode TEXT NOT NULL, embedding BLOB NOT NULL, "
+                "payload TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+        try:
+            # Drop anything expired or that no longer fits
+            with self._db:
+                self._db.execute("DELETE FROM responses WHERE created <= ?", (time.time() - self.ttl_seconds,))
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                    (self.max_size,)
+                )
+
+            rows = self._db.execute(
+                "SELECT key, mode, embedding, payload, created FROM responses ORDER BY created"
+            ).fetchall()
+            # Oldest first so the newest entries end up most recently used
+            for key, mode, embedding, payload, created in rows:
+                self._insert(
+                    key, tuple(json.loads(mode)), np.frombuffer(embedding, dtype=np.float32),
+                    json.loads(payload), created
+                )
+
+            logger.info(f"✅ Loaded {len(rows)} cached responses from {Path(path).name}")
+        except Exception as e:
+            logger.warning(f"Semantic cache load failed: {e}, starting empty")
+            self.clear()
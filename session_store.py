@@ -0,0 +1,89 @@
+"""
+Session Store Module
+Keeps per-session conversation history, bounded in memory or shared via Redis
+"""
+
+import json
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable
+from cachetools import TTLCache
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def new_history(messages: Iterable[Dict] = ()) -> Deque[Dict]:
+    """Create a conversation history that drops its oldest messages beyond the configured limit"""
+    return deque(messages, maxlen=config.MAX_CONVERSATION_HISTORY * 2)
+
+
+class SessionStore:
+    """In-process conversation memory bounded by session count and idle TTL"""
+
+    def __init__(self, max_sessions: int = None, ttl_seconds: int = None):
+        """
+        Initialize in-memory session store
+
+        Args:
+            max_sessions: Maximum number of sessions kept (oldest evicted beyond this)
+            ttl_seconds: Seconds since the last write after which a session expires
+        """
+        self._sessions = TTLCache(
+            maxsize=max_sessions or config.MAX_SESSIONS,
+            ttl=ttl_seconds or config.SESSION_TTL_SECONDS
+        )
+
+    async def get(self, session_id: str) -> Deque[Dict]:
+        """Get conversation history for a session (empty if unknown or expired)"""
+        history = self._sessions.get(session_id)
+        return history if history is not None else new_history()
+
+    async def set(self, session_id: str, history: Deque[Dict]):
+        """Store conversation history for a session, refreshing its TTL"""
+        self._sessions[session_id] = history
+
+    async def aclose(self):
+        """Release resources (nothing to do for the in-memory store)"""
+
+
+class RedisSessionStore:
+    """Conversation memory shared across worker processes via Redis"""
+
+    def __init__(self, url: str, ttl_seconds: int = None):
+        """
+        Initialize Redis-backed session store
+
+        Args:
+            url: Redis connection URL (e.g. redis://localhost:6379/0)
+            ttl_seconds: Seconds since the last write after which a session expires
+        """
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._ttl = ttl_seconds or config.SESSION_TTL_SECONDS
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    async def get(self, session_id: str) -> Deque[Dict]:
+        """Get conversation history for a session (empty if unknown or expired)"""
+        raw = await self._redis.get(self._key(session_id))
+        return new_history(json.loads(raw) if raw else ())
+
+    async def set(self, session_id: str, history: Deque[Dict]):
+        """Store conversation history for a session, refreshing its TTL"""
+        await self._redis.set(self._key(session_id), json.dumps(list(history)), ex=self._ttl)
+
+    async def aclose(self):
+        """Close the Redis connection pool"""
+        await self._redis.aclose()
+
+
+def create_session_store():
+    """Create the session store selected by config (Redis if REDIS_URL is set)"""
+    if config.REDIS_URL:
+        logger.info("✅ Using Redis session store")
+        return RedisSessionStore(config.REDIS_URL)
+    return SessionStore()
@@ -7,32 +7,148 @@ audio generation (ElevenLabs), and audio transcription (Whisper)
 import os
 import logging
 import hashlib
+import re
+import shutil
+import subprocess
+import threading
+import uuid
+import aiofiles
 import aiohttp
 import asyncio
+import numpy as np
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import AsyncIterator, Dict, List, Tuple, Optional, Sequence, Union
 import google.generativeai as genai
 from openai import AsyncOpenAI
-import whisper
+from yarl import URL
 import config
 
 logger = logging.getLogger(__name__)
 
+WHISPER_SAMPLE_RATE = 16000  # Whisper models expect 16kHz mono input
+
+# Strips emojis and other symbols from text used for image prompts and TTS
+_EMOJI_CLEAN = re.compile(r'[^\w\s.,!?\'\"-]')
+
+# Leading text up to (not including) the second sentence terminator
+_FIRST_SENTENCES = re.compile(r'[^.!?]*(?:[.!?][^.!?]*)?')
+
+# Keyword -> scene description for image prompts (IMPROVED keyword detection with more story elements)
+_IMG_KEYWORDS = (
+    ('alice', 'Alice, young Victorian girl in blue dress with white apron'),
+    ('wonderland', 'magical Wonderland with strange creatures and talking animals'),
+    ('rabbit', 'white rabbit wearing waistcoat with pocket watch, running'),
+    ('queen', 'Queen of Hearts with playing card soldiers, red and black'),
+    ('hatter', 'Mad Hatter at tea party with oversized hat, teacups everywhere'),
+    ('cheshire', 'Cheshire Cat with wide grin, purple stripes, disappearing'),
+    ('caterpillar', 'blue caterpillar smoking hookah on giant mushroom'),
+    ('gulliver', 'Gulliver the explorer in 18th century clothing'),
+    ('lilliput', 'tiny Lilliputian people, miniature buildings, giant human'),
+    ('giant', 'enormous giants, Brobdingnagians, tiny human'),
+    ('travel', 'sailing ship, ocean voyage, exotic lands'),
+    ('tea party', 'mad tea party with March Hare, Dormouse, chaotic table setting'),
+    ('arabian', 'Arabian Nights, middle eastern palace, ornate decorations'),
+    ('aladdin', 'Aladdin with magic lamp, genie, flying carpet'),
+    ('sinbad', 'Sinbad the sailor, ship, sea monsters'),
+    ('scheherazade', 'Scheherazade storytelling, sultan, Arabian palace'),
+    ('genie', 'magical genie emerging from lamp, smoke, wishes'),
+)
+
+# Fixed query string for Pollinations.ai image requests
+_POLLINATIONS_PARAMS = {
+    "width": 512,
+    "height": 512,
+    "model": "flux",
+    "nologo": "true",
+    "enhance": "true",
+}
+
+
+# Witty off-topic replies per language (English lives in config)
+_FALLBACKS = {
+    "en": config.UNKNOWN_QUERY_RESPONSE,
+    "es": "¡Espera, detente! 🤚 Eso no está en mi colección de cuentos. Estoy aquí para contar historias sobre las aventuras de Alicia en el país de las maravillas y los problemas gigantes de Gulliver, ¡no para resolver los misterios del universo! Pregúntame algo de los cuentos clásicos que realmente conozco! 📚✨",
+    "fr": "Whoa, arrêtez! 🤚 Ce n'est pas dans ma collection de livres d'histoires. Je suis ici pour raconter des histoires sur les aventures d'Alice au pays des merveilles et les problèmes géants de Gulliver - pas pour résoudre les mystères de l'univers! Demandez-moi quelque chose des histoires classiques que je connais vraiment! 📚✨",
+    "de": "Moment mal! 🤚 Das ist nicht in meiner Geschichtenbuch-Sammlung. Ich bin hier, um Geschichten über Alices Abenteuer im Wunderland und Gullivers Riesenprobleme zu erzählen - nicht um die Geheimnisse des Universums zu lösen! Frag mich etwas aus den klassischen Geschichten, die ich wirklich kenne! 📚✨",
+    "hi": "रुको, ठहरो! 🤚 यह मेरी कहानियों के संग्रह में नहीं है। मैं यहाँ एलिस के अद्भुत देश के रोमांच और गुलिवर की विशाल समस्याओं की कहानियाँ सुनाने के लिए हूँ - ब्रह्मांड के रहस्यों को सुलझाने के लिए नहीं! मुझसे उन क्लासिक कहानियों के बारे में पूछें जो मैं वास्तव में जानता हूँ! 📚✨",
+}
+
+
+def _is_nonempty_file(path: Path) -> bool:
+    """Check if a previously generated media file exists and has content"""
+    try:
+        return path.stat().st_size > 0
+    except FileNotFoundError:
+        return False
+
+
+def _text_error_message(error: Exception) -> str:
+    """User-facing reply when the LLM call fails"""
+    return f"Oops! My wit machine broke down. Try asking again! 😅 (Error: {str(error)[:100]})"
+
+
+async def _stream_to_file(response: aiohttp.ClientResponse, filepath: Path) -> int:
+    """
+    Stream an HTTP response body to disk chunk by chunk
+    
+    The body goes to a temporary file that is renamed into place when complete,
+    so a half-written file is never mistaken for a finished one.
+    
+    Returns:
+        Number of bytes written
+    """
+    tmp_path = filepath.with_name(f"{filepath.name}.{uuid.uuid4().hex}.part")
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(config.MEDIA_CHUNK_SIZE):
+                await f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return size
+
+
+def _decode_audio(data: bytes) -> np.ndarray:
+    """Decode an audio blob to 16kHz mono float32 PCM by piping it through FFmpeg"""
+    cmd = [
+        "ffmpeg", "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le",
+        "-ar", str(WHISPER_SAMPLE_RATE),
+        "pipe:1"
+    ]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode(errors='ignore')[-300:]}") from e
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
 
 class Storyteller:
     """Witty storyteller with multimodal generation capabilities"""
     
-    def __init__(self, document_processor):
+    def __init__(self, document_processor, semantic_cache=None):
         """
         Initialize storyteller
         
         Args:
             document_processor: Initialized DocumentProcessor instance
+            semantic_cache: Optional SemanticCache for reusing answers to near-duplicate questions
         """
         self.processor = document_processor
+        self.semantic_cache = semantic_cache
         self.openai_client = None
         self.gemini_model = None
         self.whisper_model = None
+        self._session = None  # Shared aiohttp session, created on first use
+        
+        # Per-service caps on in-flight upstream calls, so bursts queue here instead of hitting rate limits
+        self._img_sem = asyncio.Semaphore(config.IMG_CONCURRENCY)
+        self._audio_sem = asyncio.Semaphore(config.AUDIO_CONCURRENCY)
+        self._llm_sem = asyncio.Semaphore(config.LLM_CONCURRENCY)
         
         # Initialize LLM based on provider
         if config.LLM_PROVIDER == "gemini" and config.GEMINI_API_KEY:
@@ -45,12 +161,37 @@ class Storyteller:
         else:
             logger.warning(f"⚠️  No valid LLM configured for provider: {config.LLM_PROVIDER}")
         
-        # Initialize Whisper for audio transcription
-        try:
-            self.whisper_model = whisper.load_model("base")
-            logger.info("✅ Whisper initialized for audio transcription")
-        except Exception as e:
-            logger.warning(f"⚠️  Whisper not available: {str(e)}")
+        # Whisper is loaded on first transcription so text-only use never pays for it
+        self._whisper_load_lock = asyncio.Lock()
+        self._whisper_lock = threading.Lock()  # whisper.cpp contexts are not re-entrant
+        
+        # language -> (image_url, audio_url) for the off-topic reply, filled by warm_fallback_media()
+        self._fallback_media: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        
+        # Set once ElevenLabs rejects our key (invalid or quota used up) - not a transient failure
+        self._audio_rejected = False
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session (keep-alive pool reused by image and audio calls)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=config.HTTP_POOL_SIZE,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+    
+    async def aclose(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+    
+    def has_llm(self) -> bool:
+        """Check if a text generation provider is configured"""
+        return self.gemini_model is not None or self.openai_client is not None
     
     async def generate_response(
         self,
@@ -58,7 +199,7 @@ class Storyteller:
         generate_image: bool = True,
         generate_audio: bool = True,
         language: str = "en",
-        conversation_history: List[Dict] = None
+        conversation_history: Sequence[Dict] = None
     ) -> Dict:
         """
         Generate complete multimodal response
@@ -76,8 +217,43 @@ class Storyteller:
         if conversation_history is None:
             conversation_history = []
         
+        # Serve near-duplicate questions from the semantic cache, keyed per generation mode.
+        # Answers shaped by a conversation belong to that session, so only history-free turns use it.
+        use_cache = self.semantic_cache is not None and not conversation_history
+        if use_cache:
+            cache_mode = (language, generate_image, generate_audio)
+            question_embedding = await asyncio.to_thread(self.processor.embed_query, question)
+            cached = self.semantic_cache.get(question_embedding, cache_mode)
+            if cached is not None:
+                logger.info("⚡ Semantic cache hit")
+                return cached
+        
+        result, text_ok = await self._generate_response_uncached(
+            question, generate_image, generate_audio, language, conversation_history
+        )
+        
+        if use_cache and self._is_cacheable(result, text_ok, generate_image, generate_audio):
+            self.semantic_cache.put(question_embedding, cache_mode, result)
+        return result
+    
+    async def _generate_response_uncached(
+        self,
+        question: str,
+        generate_image: bool,
+        generate_audio: bool,
+        language: str,
+        conversation_history: Sequence[Dict]
+    ) -> Tuple[Dict, bool]:
+        """
+        Run retrieval, text, image and audio generation for a question
+        
+        Returns:
+            (response dict, text_ok) tuple; text_ok is False when the answer is an error
+            or "not available" message rather than real LLM output
+        """
         # Retrieve relevant context - INCREASED TO 5 for better coverage
-        results = self.processor.semantic_search(question, top_k=5)
+        # (embedding + search are CPU-bound, keep them off the event loop)
+        results = await asyncio.to_thread(self.processor.semantic_search, question, 5)
         
         # Check relevance
         is_relevant = self._is_relevant(results)
@@ -85,20 +261,9 @@ class Storyteller:
         if not is_relevant:
             # Return witty fallback but still try to generate media so UI always shows a photo/audio
             fallback = self._get_fallback_message(language)
-
-            image_url = None
-            audio_url = None
-            if generate_image and config.IMAGE_GENERATION_ENABLED:
-                try:
-                    image_url = await self._generate_image(question, fallback)
-                except Exception as _e:
-                    image_url = None
-
-            if generate_audio and config.AUDIO_ENABLED:
-                try:
-                    audio_url = await self._generate_audio(fallback, language)
-                except Exception as _e:
-                    audio_url = None
+            image_url, audio_url = await self._get_fallback_media(
+                question, fallback, language, generate_image, generate_audio
+            )
 
             return {
                 "answer": fallback,
@@ -106,76 +271,383 @@ class Storyteller:
                 "audio_url": audio_url,
                 "is_relevant": False,
                 "sources": []
-            }
+            }, True
         
         # Extract context and sources
-        context = "\n\n".join([chunk for chunk, _, _ in results])
-        sources = [
-            {
-                "text": chunk[:200] + "...",
-                "source": meta["source"],
-                "score": f"{score:.2f}"
-            }
-            for chunk, meta, score in results
-        ]
+        context, sources = self._build_context(results)
         
         # Generate witty text response
-        answer = await self._generate_text(question, context, language, conversation_history)
+        text_ok = self.has_llm()
+        try:
+            answer = await self._generate_text(question, context, language, conversation_history)
+        except Exception as e:
+            logger.error(f"❌ Error generating text: {str(e)}", exc_info=True)
+            answer = _text_error_message(e)
+            text_ok = False
         
         # Generate image and audio in parallel
-        tasks = []
-        if generate_image and config.IMAGE_GENERATION_ENABLED:
-            tasks.append(self._generate_image(question, answer))
-        else:
-            tasks.append(asyncio.create_task(asyncio.sleep(0)))
+        image_url, audio_url = await self._generate_media(
+            question, answer, language, generate_image, generate_audio
+        )
+        
+        return {
+            "answer": answer,
+            "image_url": image_url,
+            "audio_url": audio_url,
+            "is_relevant": True,
+            "sources": sources
+        }, text_ok
+    
+    def _audio_available(self) -> bool:
+        """Whether ElevenLabs narration can currently be produced at all"""
+        return config.AUDIO_ENABLED and bool(config.ELEVENLABS_API_KEY) and not self._audio_rejected
+    
+    def _is_cacheable(self, result: Dict, text_ok: bool, generate_image: bool, generate_audio: bool) -> bool:
+        """
+        Only cache complete responses, so a transient upstream failure isn't served for a whole TTL.
+        Media that can't be produced in this setup (e.g. no ElevenLabs key) doesn't count as missing.
+        """
+        if not text_ok:
+            return False
+        if generate_image and config.IMAGE_GENERATION_ENABLED and not result["image_url"]:
+            return False
+        if generate_audio and self._audio_available() and not result["audio_url"]:
+            return False
+        return True
+    
+    async def _generate_media(
+        self,
+        question: str,
+        answer: str,
+        language: str,
+        generate_image: bool,
+        generate_audio: bool
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Generate image and audio for an answer concurrently
         
+        Args:
+            question: User's question
+            answer: Answer text to illustrate and narrate
+            language: Language code for narration
+            generate_image: Whether to generate image
+            generate_audio: Whether to generate audio
+            
+        Returns:
+            (image_url, audio_url) tuple, None for anything skipped or failed
+        """
+        coros = []
+        keys = []
+        if generate_image and config.IMAGE_GENERATION_ENABLED:
+            coros.append(self._generate_image(question, answer))
+            keys.append("image")
         if generate_audio and config.AUDIO_ENABLED:
-            tasks.append(self._generate_audio(answer, language))
+            coros.append(self._generate_audio(answer, language))
+            keys.append("audio")
+        
+        results = await asyncio.gather(*coros, return_exceptions=True) if coros else []
+        
+        # Failed generations become None rather than failing the response
+        out = {"image": None, "audio": None}
+        for key, result in zip(keys, results):
+            if not isinstance(result, BaseException):
+                out[key] = result
+        return out["image"], out["audio"]
+    
+    async def warm_fallback_media(self):
+        """Generate the off-topic reply's image and audio once per language"""
+        for language, message in _FALLBACKS.items():
+            self._fallback_media[language] = await self._generate_media(
+                "", message, language, True, True
+            )
+        logger.info(f"🔥 Fallback media ready for {len(self._fallback_media)} languages")
+    
+    async def _get_fallback_media(
+        self,
+        question: str,
+        fallback: str,
+        language: str,
+        generate_image: bool,
+        generate_audio: bool
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Media for the off-topic reply: each prewarmed URL if available, only the missing kinds generated now"""
+        want_image = generate_image and config.IMAGE_GENERATION_ENABLED
+        want_audio = generate_audio and config.AUDIO_ENABLED
+        stock_image, stock_audio = self._fallback_media.get(language, (None, None))
+        
+        image_url, audio_url = await self._generate_media(
+            question, fallback, language,
+            want_image and not stock_image,
+            want_audio and not stock_audio
+        )
+        if want_image and stock_image:
+            image_url = stock_image
+        if want_audio and stock_audio:
+            audio_url = stock_audio
+        return image_url, audio_url
+    
+    async def generate_response_stream(
+        self,
+        question: str,
+        generate_image: bool = True,
+        generate_audio: bool = True,
+        language: str = "en",
+        conversation_history: Sequence[Dict] = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Generate a multimodal response incrementally
+        
+        Args:
+            question: User's question
+            generate_image: Whether to generate image
+            generate_audio: Whether to generate audio
+            language: Target language code
+            conversation_history: Previous conversation messages
+            
+        Yields:
+            (event, data) pairs: "token" with answer text fragments, then "image"/"audio"
+            with their URL as each finishes, then "done" with the same dictionary
+            generate_response returns
+        """
+        if conversation_history is None:
+            conversation_history = []
+        
+        # Same rule as generate_response: conversation-dependent answers are never shared
+        use_cache = self.semantic_cache is not None and not conversation_history
+        if use_cache:
+            cache_mode = (language, generate_image, generate_audio)
+            question_embedding = await asyncio.to_thread(self.processor.embed_query, question)
+            cached = self.semantic_cache.get(question_embedding, cache_mode)
+            if cached is not None:
+                # Replay the cached response in the same event shape
+                logger.info("⚡ Semantic cache hit")
+                yield "token", {"text": cached["answer"]}
+                if cached.get("image_url"):
+                    yield "image", {"url": cached["image_url"]}
+                if cached.get("audio_url"):
+                    yield "audio", {"url": cached["audio_url"]}
+                yield "done", cached
+                return
+        
+        results = await asyncio.to_thread(self.processor.semantic_search, question, 5)
+        is_relevant = self._is_relevant(results)
+        
+        if not is_relevant:
+            answer = self._get_fallback_message(language)
+            sources = []
+            text_ok = True
+            yield "token", {"text": answer}
         else:
-            tasks.append(asyncio.create_task(asyncio.sleep(0)))
+            context, sources = self._build_context(results)
+            text_ok = self.has_llm()
+            parts = []
+            try:
+                async for text in self._stream_text(question, context, language, conversation_history):
+                    parts.append(text)
+                    yield "token", {"text": text}
+            except Exception as e:
+                logger.error(f"❌ Error streaming text: {str(e)}", exc_info=True)
+                parts.append(_text_error_message(e))
+                yield "token", {"text": parts[-1]}
+                text_ok = False
+            answer = "".join(parts).strip()
+        
+        want = {
+            "image": generate_image and config.IMAGE_GENERATION_ENABLED,
+            "audio": generate_audio and config.AUDIO_ENABLED
+        }
         
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Off-topic replies reuse the media prewarmed for their language
+        stock = {"image": None, "audio": None}
+        if not is_relevant:
+            stock["image"], stock["audio"] = self._fallback_media.get(language, (None, None))
         
-        # Handle results with proper None fallback
-        image_url = results[0] if not isinstance(results[0], Exception) and results[0] is not None else None
-        audio_url = results[1] if not isinstance(results[1], Exception) and results[1] is not None else None
+        # Start image and audio together and report each as soon as it is ready
+        pending = {}
+        if want["image"] and not stock["image"]:
+            pending[asyncio.create_task(self._generate_image(question, answer))] = "image"
+        if want["audio"] and not stock["audio"]:
+            pending[asyncio.create_task(self._generate_audio(answer, language))] = "audio"
         
-        return {
+        media = {"image": None, "audio": None}
+        try:
+            for kind in ("image", "audio"):
+                if want[kind] and stock[kind]:
+                    media[kind] = stock[kind]
+                    yield kind, {"url": media[kind]}
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind = pending.pop(task)
+                    media[kind] = None if task.exception() else task.result()
+                    yield kind, {"url": media[kind]}
+        finally:
+            # Client disconnected mid-stream - don't leave generations running
+            for task in pending:
+                task.cancel()
+        
+        result = {
             "answer": answer,
-            "image_url": image_url,
-            "audio_url": audio_url,
-            "is_relevant": True,
+            "image_url": media["image"],
+            "audio_url": media["audio"],
+            "is_relevant": is_relevant,
             "sources": sources
         }
+        if use_cache and self._is_cacheable(result, text_ok, generate_image, generate_audio):
+            self.semantic_cache.put(question_embedding, cache_mode, result)
+        yield "done", result
+    
+    def _build_context(self, results: List[Tuple]) -> Tuple[str, List[Dict]]:
+        """Join retrieved chunks into LLM context and summarize them as sources"""
+        context = "\n\n".join([chunk for chunk, _, _ in results])
+        sources = [
+            {
+                "text": chunk[:200] + "...",
+                "source": meta["source"],
+                "score": f"{score:.2f}"
+            }
+            for chunk, meta, score in results
+        ]
+        return context, sources
     
     def _is_relevant(self, results: List[Tuple]) -> bool:
         """Check if retrieved results are relevant"""
         if not results:
             return False
         
-        # Check average similarity score - LOWERED threshold for better recall
-        avg_score = sum(score for _, _, score in results) / len(results)
-        
         # Threshold for relevance (lowered from 0.3 to 0.25)
-        return avg_score > 0.25
+        threshold = 0.25
+        
+        # Results are sorted best-first: if the top score misses, the average can't pass
+        if results[0][2] <= threshold:
+            return False
+        
+        # Check average similarity score - LOWERED threshold for better recall
+        scores = [score for _, _, score in results]
+        return sum(scores) / len(scores) > threshold
     
     def _get_fallback_message(self, language: str) -> str:
         """Get fallback message in specified language"""
-        fallbacks = {
-            "en": config.UNKNOWN_QUERY_RESPONSE,
-            "es": "¡Espera, detente! 🤚 Eso no está en mi colección de cuentos. Estoy aquí para contar historias sobre las aventuras de Alicia en el país de las maravillas y los problemas gigantes de Gulliver, ¡no para resolver los misterios del universo! Pregúntame algo de los cuentos clásicos que realmente conozco! 📚✨",
-            "fr": "Whoa, arrêtez! 🤚 Ce n'est pas dans ma collection de livres d'histoires. Je suis ici pour raconter des histoires sur les aventures d'Alice au pays des merveilles et les problèmes géants de Gulliver - pas pour résoudre les mystères de l'univers! Demandez-moi quelque chose des histoires classiques que je connais vraiment! 📚✨",
-            "de": "Moment mal! 🤚 Das ist nicht in meiner Geschichtenbuch-Sammlung. Ich bin hier, um Geschichten über Alices Abenteuer im Wunderland und Gullivers Riesenprobleme zu erzählen - nicht um die Geheimnisse des Universums zu lösen! Frag mich etwas aus den klassischen Geschichten, die ich wirklich kenne! 📚✨",
-            "hi": "रुको, ठहरो! 🤚 यह मेरी कहानियों के संग्रह में नहीं है। मैं यहाँ एलिस के अद्भुत देश के रोमांच और गुलिवर की विशाल समस्याओं की कहानियाँ सुनाने के लिए हूँ - ब्रह्मांड के रहस्यों को सुलझाने के लिए नहीं! मुझसे उन क्लासिक कहानियों के बारे में पूछें जो मैं वास्तव में जानता हूँ! 📚✨",
-        }
-        return fallbacks.get(language, fallbacks["en"])
+        return _FALLBACKS.get(language, _FALLBACKS["en"])
+    
+    def _build_prompt(self, question: str, context: str, language: str) -> str:
+        """Build the storyteller prompt with context and language instruction"""
+        # Add STRONG language instruction
+        lang_name = config.SUPPORTED_LANGUAGES.get(language, "English")
+        if language != "en":
+            lang_instruction = f"\n\n**CRITICAL: You MUST respond ENTIRELY in {lang_name}. Do NOT use English. Translate everything to {lang_name}.**"
+        else:
+            lang_instruction = ""
+        
+        return config.STORYTELLER_PROMPT.format(
+            context=context,
+            question=question
+        ) + lang_instruction
+    
+    @staticmethod
+    def _recent_history(conversation_history: Sequence[Dict]) -> List[Dict]:
+        """Last 3 exchanges of the conversation, without copying the whole history"""
+        start = max(len(conversation_history) - 6, 0)
+        return list(islice(conversation_history, start, None))
+    
+    def _build_openai_messages(self, base_prompt: str, conversation_history: Sequence[Dict]) -> List[Dict]:
+        """Build OpenAI chat messages from recent history plus the current prompt"""
+        return [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in self._recent_history(conversation_history)
+        ] + [{"role": "user", "content": base_prompt}]
+    
+    def _build_gemini_prompt(self, base_prompt: str, conversation_history: Sequence[Dict]) -> str:
+        """Prefix the prompt with recent conversation history for Gemini"""
+        if not conversation_history:
+            return base_prompt
+        history_text = "".join(
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+            for msg in self._recent_history(conversation_history)
+        )
+        return f"\n\nPrevious conversation:\n{history_text}\n{base_prompt}"
+    
+    async def _stream_text(
+        self,
+        question: str,
+        context: str,
+        language: str = "en",
+        conversation_history: Sequence[Dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream witty text response from Gemini or OpenAI as it is generated
+        
+        Args:
+            question: User's question
+            context: Retrieved context from books
+            language: Target language code
+            conversation_history: Previous conversation messages
+            
+        Yields:
+            Answer text fragments in order
+            
+        Raises:
+            Exception: Provider errors, after any fragments already yielded
+        """
+        if conversation_history is None:
+            conversation_history = []
+        
+        if not self.has_llm():
+            yield "Sorry, text generation is not available. Please configure LLM API key."
+            return
+        
+        base_prompt = self._build_prompt(question, context, language)
+        
+        # The provider is drained into a queue by a separate task, so the LLM slot is
+        # released as soon as the provider finishes - not when a slow client catches up
+        fragments: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_llm_stream(base_prompt, conversation_history, fragments))
+        reader.add_done_callback(lambda _: fragments.put_nowait(None))
+        try:
+            while (text := await fragments.get()) is not None:
+                yield text
+            reader.result()  # Re-raise provider errors after the fragments already received
+        finally:
+            reader.cancel()
+    
+    async def _read_llm_stream(
+        self,
+        base_prompt: str,
+        conversation_history: Sequence[Dict],
+        fragments: asyncio.Queue
+    ):
+        """Stream a completion from the configured provider into a queue while holding an LLM slot"""
+        async with self._llm_sem:
+            if config.LLM_PROVIDER == "openai" and self.openai_client:
+                stream = await self.openai_client.chat.completions.create(
+                    model=config.LLM_MODEL,
+                    messages=self._build_openai_messages(base_prompt, conversation_history),
+                    temperature=config.LLM_TEMPERATURE,
+                    max_tokens=config.LLM_MAX_TOKENS,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        fragments.put_nowait(chunk.choices[0].delta.content)
+            
+            elif config.LLM_PROVIDER == "gemini" and self.gemini_model:
+                response = await self.gemini_model.generate_content_async(
+                    self._build_gemini_prompt(base_prompt, conversation_history),
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=config.LLM_TEMPERATURE,
+                        max_output_tokens=config.LLM_MAX_TOKENS,
+                    ),
+                    stream=True
+                )
+                async for chunk in response:
+                    fragments.put_nowait(chunk.text)
     
     async def _generate_text(
         self, 
         question: str, 
         context: str, 
         language: str = "en",
-        conversation_history: List[Dict] = None
+        conversation_history: Sequence[Dict] = None
     ) -> str:
         """
         Generate witty text response using Gemini or OpenAI
@@ -188,85 +660,47 @@ class Storyteller:
             
         Returns:
             Witty answer string
+            
+        Raises:
+            Exception: Provider errors, so callers can tell a failure from a real answer
         """
         if conversation_history is None:
             conversation_history = []
         
-        try:
-            # Add STRONG language instruction
-            lang_name = config.SUPPORTED_LANGUAGES.get(language, "English")
-            if language != "en":
-                lang_instruction = f"\n\n**CRITICAL: You MUST respond ENTIRELY in {lang_name}. Do NOT use English. Translate everything to {lang_name}.**"
-            else:
-                lang_instruction = ""
-            
-            # Build prompt with conversation context
-            base_prompt = config.STORYTELLER_PROMPT.format(
-                context=context,
-                question=question
-            ) + lang_instruction
+        base_prompt = self._build_prompt(question, context, language)
+        
+        if config.LLM_PROVIDER == "openai" and self.openai_client:
+            # Use OpenAI
+            messages = self._build_openai_messages(base_prompt, conversation_history)
             
-            if config.LLM_PROVIDER == "openai" and self.openai_client:
-                # Use OpenAI
-                messages = []
-                
-                # Add conversation history
-                for msg in conversation_history[-6:]:  # Last 3 exchanges
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-                
-                # Add current prompt
-                messages.append({
-                    "role": "user",
-                    "content": base_prompt
-                })
-                
+            async with self._llm_sem:
                 response = await self.openai_client.chat.completions.create(
                     model=config.LLM_MODEL,
                     messages=messages,
                     temperature=config.LLM_TEMPERATURE,
                     max_tokens=config.LLM_MAX_TOKENS
                 )
-                
-                answer = response.choices[0].message.content.strip()
-                logger.info(f"✅ OpenAI generated response ({len(answer)} chars)")
-                return answer
-                
-            elif config.LLM_PROVIDER == "gemini" and self.gemini_model:
-                # Use Gemini
-                # Add conversation history to prompt
-                if conversation_history:
-                    history_text = "\n\nPrevious conversation:\n"
-                    for msg in conversation_history[-6:]:
-                        role = "User" if msg["role"] == "user" else "Assistant"
-                        history_text += f"{role}: {msg['content']}\n"
-                    base_prompt = history_text + "\n" + base_prompt
-                
-                response = await asyncio.to_thread(
-                    self.gemini_model.generate_content,
-                    base_prompt,
+            
+            answer = response.choices[0].message.content.strip()
+            logger.info(f"✅ OpenAI generated response ({len(answer)} chars)")
+            return answer
+            
+        elif config.LLM_PROVIDER == "gemini" and self.gemini_model:
+            # Use Gemini
+            async with self._llm_sem:
+                response = await self.gemini_model.generate_content_async(
+                    self._build_gemini_prompt(base_prompt, conversation_history),
                     generation_config=genai.types.GenerationConfig(
                         temperature=config.LLM_TEMPERATURE,
                         max_output_tokens=config.LLM_MAX_TOKENS,
                     )
                 )
-                
-                answer = response.text.strip()
-                logger.info(f"✅ Gemini generated response ({len(answer)} chars)")
-                return answer
-            else:
-                return "Sorry, text generation is not available. Please configure LLM API key."
             
-        except Exception as e:
-            logger.error(f"❌ Error generating text: {str(e)}", exc_info=True)
-            logger.error(f"Full exception details: {repr(e)}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            traceback.print_exc()
-            # Return error with details for debugging
-            return f"Oops! My wit machine broke down. Try asking again! 😅 (Error: {str(e)[:100]})"
+            answer = response.text.strip()
+            logger.info(f"✅ Gemini generated response ({len(answer)} chars)")
+            return answer
+        else:
+            return "Sorry, text generation is not available. Please configure LLM API key."
     
     async def _generate_image(self, question: str, answer: str) -> str:
         """
@@ -292,28 +726,31 @@ class Storyteller:
                 # Fallback to simple prompt from answer
                 prompt = self._create_image_prompt_from_answer(answer)
             
-            # Use Pollinations.ai FREE image generation
-            import urllib.parse
-            encoded_prompt = urllib.parse.quote(prompt)
+            # Same prompt -> same file; reuse it instead of regenerating remotely
+            filename = hashlib.md5(prompt.encode()).hexdigest() + ".png"
+            filepath = config.IMAGES_DIR / filename
+            if _is_nonempty_file(filepath):
+                logger.info(f"♻️ Reusing existing image: {filename}")
+                return f"/static/images/{filename}"
             
-            image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=512&height=512&model=flux&nologo=true&enhance=true"
+            # Use Pollinations.ai FREE image generation (yarl percent-encodes the prompt path)
+            image_url = URL.build(
+                scheme="https",
+                host="image.pollinations.ai",
+                path=f"/prompt/{prompt}",
+                query=_POLLINATIONS_PARAMS
+            )
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status == 200:
-                        image_data = await response.read()
-                        
-                        filename = hashlib.md5(prompt.encode()).hexdigest() + ".png"
-                        filepath = config.IMAGES_DIR / filename
-                        
-                        with open(filepath, "wb") as f:
-                            f.write(image_data)
-                        
-                        logger.info(f"✅ AI image generated: {filename}")
-                        return f"/static/images/{filename}"
-                    else:
-                        logger.warning(f"⚠️ Image API returned status {response.status}")
-                        return None
+            session = await self.get_session()
+            async with self._img_sem, session.get(image_url) as response:
+                if response.status == 200:
+                    await _stream_to_file(response, filepath)
+                    
+                    logger.info(f"✅ AI image generated: {filename}")
+                    return f"/static/images/{filename}"
+                else:
+                    logger.warning(f"⚠️ Image API returned status {response.status}")
+                    return None
                         
         except Exception as e:
             logger.error(f"❌ Image generation error: {str(e)}")
@@ -321,13 +758,8 @@ class Storyteller:
     
     def _create_image_prompt_from_answer(self, answer: str) -> str:
         """Create AI image prompt from the answer content"""
-        import re
-        # Remove emojis and clean text
-        clean_answer = re.sub(r'[^\w\s.,!?\'\"-]', '', answer)
-        
-        # Take first 2 sentences for context
-        sentences = clean_answer.split('.')[:2]
-        context = '. '.join(sentences).strip()
+        # Remove emojis, then take the first 2 sentences for context
+        context = _FIRST_SENTENCES.match(_EMOJI_CLEAN.sub('', answer)).group(0).strip()
         
         # Enhanced prompt for better images
         prompt = f"""A beautiful whimsical storybook illustration of: {context}. 
@@ -359,116 +791,98 @@ class Storyteller:
             logger.info(f"🎵 Starting audio generation for {len(text)} chars...")
             
             # Clean text for TTS (remove emojis)
-            import re
-            clean_text = re.sub(r'[^\w\s.,!?\'\"-]', '', text)
+            clean_text = _EMOJI_CLEAN.sub('', text)
             
             if len(clean_text) == 0:
                 logger.warning("⚠️ No text to generate audio from")
                 return None
             
+            # Same text -> same narration; reuse it instead of calling ElevenLabs again
+            filename = hashlib.md5(clean_text.encode()).hexdigest() + ".mp3"
+            filepath = config.AUDIO_DIR / filename
+            if _is_nonempty_file(filepath):
+                logger.info(f"♻️ Reusing existing audio: {filename}")
+                return f"/static/audio/{filename}"
+            
             # Call ElevenLabs API
             url = f"{config.ELEVENLABS_API_URL}/{config.ELEVENLABS_VOICE_ID}"
             
             logger.info(f"📡 Calling ElevenLabs API: {url}")
             
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "xi-api-key": config.ELEVENLABS_API_KEY,
-                    "Content-Type": "application/json"
+            session = await self.get_session()
+            headers = {
+                "xi-api-key": config.ELEVENLABS_API_KEY,
+                "Content-Type": "application/json"
+            }
+            
+            payload = {
+                "text": clean_text[:500],  # Limit to 500 chars for faster generation
+                "model_id": "eleven_multilingual_v2" if language != "en" else "eleven_monolingual_v1",
+                "voice_settings": {
+                    "stability": config.AUDIO_STABILITY,
+                    "similarity_boost": config.AUDIO_SIMILARITY_BOOST
                 }
+            }
+            
+            async with self._audio_sem, session.post(url, headers=headers, json=payload) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"❌ ElevenLabs API error {response.status}: {error_text}")
+                    if response.status == 401:  # Invalid key or quota exceeded
+                        self._audio_rejected = True
+                    return None
                 
-                payload = {
-                    "text": clean_text[:500],  # Limit to 500 chars for faster generation
-                    "model_id": "eleven_multilingual_v2" if language != "en" else "eleven_monolingual_v1",
-                    "voice_settings": {
-                        "stability": config.AUDIO_STABILITY,
-                        "similarity_boost": config.AUDIO_SIMILARITY_BOOST
-                    }
-                }
+                # Save audio
+                size = await _stream_to_file(response, filepath)
+                self._audio_rejected = False
                 
-                async with session.post(url, headers=headers, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"❌ ElevenLabs API error {response.status}: {error_text}")
-                        return None
-                    
-                    audio_data = await response.read()
-                    
-                    # Save audio
-                    filename = hashlib.md5(clean_text.encode()).hexdigest() + ".mp3"
-                    filepath = config.AUDIO_DIR / filename
-                    
-                    with open(filepath, "wb") as f:
-                        f.write(audio_data)
-                    
-                    logger.info(f"✅ Audio generated successfully: {filename} ({len(audio_data)} bytes)")
-                    return f"/static/audio/{filename}"
+                logger.info(f"✅ Audio generated successfully: {filename} ({size} bytes)")
+                return f"/static/audio/{filename}"
                     
         except Exception as e:
             logger.error(f"❌ Error generating audio: {str(e)}", exc_info=True)
             return None
     
-    async def transcribe_audio(self, audio_path: str) -> str:
+    async def transcribe_bytes(self, data: Union[bytes, bytearray], mime: str = None) -> str:
         """
-        Transcribe audio to text using Whisper
+        Transcribe an in-memory audio blob to text using Whisper
         
         Args:
-            audio_path: Path to audio file
+            data: Raw audio bytes as uploaded by the client (webm, wav, mp3, ...)
+            mime: Content type reported by the client (informational)
             
         Returns:
             Transcribed text
         """
-        if not self.whisper_model:
-            logger.error("❌ Whisper model not initialized")
-            raise Exception("Whisper model not initialized")
+        await self._ensure_whisper_model()
         
         try:
-            logger.info(f"🎙️ Transcribing audio file: {audio_path}")
+            logger.info("🎙️ Transcribing %d bytes of audio (%s)", len(data), mime or "unknown type")
             
-            # Check if file exists
-            if not os.path.exists(audio_path):
-                raise Exception(f"Audio file not found: {audio_path}")
-            
-            # Check file size
-            file_size = os.path.getsize(audio_path)
-            logger.info(f"📦 Audio file size: {file_size} bytes")
-            
-            if file_size < 1000:  # Less than 1KB
-                logger.warning(f"⚠️ Audio file too small: {file_size} bytes")
+            if len(data) < 1000:  # Less than 1KB
+                logger.warning("⚠️ Audio too small: %d bytes", len(data))
                 return "Recording too short or empty. Please speak clearly for at least 1-2 seconds."
             
             # Check if FFmpeg is available
-            import shutil
             ffmpeg_path = shutil.which("ffmpeg")
             if not ffmpeg_path:
                 logger.error("❌ FFmpeg not found in PATH")
                 raise Exception("FFmpeg not found. Please install FFmpeg and add it to your system PATH, then restart the backend.")
             
-            logger.info(f"✅ FFmpeg found at: {ffmpeg_path}")
-            
-            # Transcribe with language hint (Whisper handles various audio formats including webm)
-            logger.info(f"🎯 Starting Whisper transcription...")
-            result = await asyncio.to_thread(
-                self.whisper_model.transcribe,
-                audio_path,
-                fp16=False,  # Disable fp16 for CPU compatibility
-                language='en',  # Hint English for better accuracy
-                task='transcribe'
-            )
-            
-            text = result["text"].strip()
+            # Decode straight from memory (no temp file) and transcribe with language hint
+            logger.info("🎯 Starting Whisper transcription...")
+            audio = await asyncio.to_thread(_decode_audio, data)
+            text = await asyncio.to_thread(self._run_whisper, audio)
             
             if not text:
                 logger.warning("⚠️ Transcription returned empty text")
                 return "Sorry, I couldn't hear anything clearly. Please speak louder and try again."
             
-            logger.info(f"✅ Audio transcribed successfully: {text[:100]}...")
+            logger.info("✅ Audio transcribed successfully: %s...", text[:100])
             return text
             
         except Exception as e:
-            logger.error(f"❌ Error transcribing audio: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("❌ Error transcribing audio: %s", e)
             
             # Provide helpful error message based on error type
             error_msg = str(e)
@@ -477,6 +891,53 @@ class Storyteller:
             else:
                 raise Exception(f"Transcription failed: {str(e)}")
     
+    async def _ensure_whisper_model(self):
+        """Load the Whisper model on first use (concurrent callers wait for the same load)"""
+        async with self._whisper_load_lock:
+            if self.whisper_model is not None:
+                return
+            try:
+                self.whisper_model = await asyncio.to_thread(self._load_whisper_model)
+                logger.info(f"✅ Whisper initialized for audio transcription ({config.WHISPER_BACKEND})")
+            except Exception as e:
+                logger.error(f"❌ Whisper not available: {str(e)}")
+                raise Exception("Whisper model not initialized")
+    
+    def _load_whisper_model(self):
+        """Load the speech-to-text model for the configured backend"""
+        if config.WHISPER_BACKEND == "whispercpp":
+            from pywhispercpp.model import Model
+            return Model(
+                config.WHISPERCPP_MODEL,
+                n_threads=os.cpu_count(),
+                language="en",
+                print_progress=False,
+                print_realtime=False
+            )
+        
+        from faster_whisper import WhisperModel
+        return WhisperModel(
+            config.WHISPER_MODEL,
+            device="cpu",
+            compute_type=config.WHISPER_COMPUTE_TYPE
+        )
+    
+    def _run_whisper(self, audio: np.ndarray) -> str:
+        """Run Whisper on decoded audio (blocking - call from a worker thread)"""
+        if config.WHISPER_BACKEND == "whispercpp":
+            with self._whisper_lock:
+                segments = self.whisper_model.transcribe(audio)
+            return " ".join(segment.text.strip() for segment in segments).strip()
+        
+        segments, _ = self.whisper_model.transcribe(
+            audio,
+            language="en",  # Hint English for better accuracy
+            beam_size=1,  # Greedy decoding is plenty for short voice questions
+            vad_filter=True  # Skip leading/trailing silence
+        )
+        # Segments are generated lazily, so decoding happens while joining
+        return "".join(segment.text for segment in segments).strip()
+    
     def _create_image_prompt(self, question: str, answer: str) -> str:
         """
         Create optimized image prompt for Stability AI
@@ -488,34 +949,10 @@ class Storyteller:
         Returns:
             Image prompt string
         """
-        # IMPROVED keyword detection with more story elements
-        keywords = {
-            'alice': 'Alice, young Victorian girl in blue dress with white apron',
-            'wonderland': 'magical Wonderland with strange creatures and talking animals',
-            'rabbit': 'white rabbit wearing waistcoat with pocket watch, running',
-            'queen': 'Queen of Hearts with playing card soldiers, red and black',
-            'hatter': 'Mad Hatter at tea party with oversized hat, teacups everywhere',
-            'cheshire': 'Cheshire Cat with wide grin, purple stripes, disappearing',
-            'caterpillar': 'blue caterpillar smoking hookah on giant mushroom',
-            'gulliver': 'Gulliver the explorer in 18th century clothing',
-            'lilliput': 'tiny Lilliputian people, miniature buildings, giant human',
-            'giant': 'enormous giants, Brobdingnagians, tiny human',
-            'travel': 'sailing ship, ocean voyage, exotic lands',
-            'tea party': 'mad tea party with March Hare, Dormouse, chaotic table setting',
-            'arabian': 'Arabian Nights, middle eastern palace, ornate decorations',
-            'aladdin': 'Aladdin with magic lamp, genie, flying carpet',
-            'sinbad': 'Sinbad the sailor, ship, sea monsters',
-            'scheherazade': 'Scheherazade storytelling, sultan, Arabian palace',
-            'genie': 'magical genie emerging from lamp, smoke, wishes',
-        }
-        
         combined = (question + " " + answer).lower()
         
         # Find ALL matching keywords
-        found = []
-        for key, desc in keywords.items():
-            if key in combined:
-                found.append(desc)
+        found = [desc for key, desc in _IMG_KEYWORDS if key in combined]
         
         # Build detailed scene description
         if found: